@@ -1,91 +1,130 @@
-from passlib.context import CryptContext
-from datetime import timedelta, datetime
-from jose import JWTError, jwt
+import bcrypt
+from datetime import timedelta
+import base64
+import hashlib
+import hmac
+import time
+import orjson
 from fastapi import HTTPException, status, Depends
 import os
 import redis
 from dotenv import load_dotenv
 import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from random import randint
+import threading
+from email.message import EmailMessage
+from string import Template
+from secrets import randbelow
 
 load_dotenv()
 algorithm = os.getenv("algorithm")
 secret_key = os.getenv("secret_key")
 
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+bcrypt_rounds = int(os.getenv("bcrypt_rounds", "12"))
 
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=bcrypt_rounds)).decode()
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
+
+# --- JWT SIGNING ---
+# Tokens are only ever HMAC-signed, so the header is fixed per process and
+# can be encoded once instead of on every login.
+_HMAC_DIGESTS = {"HS256": hashlib.sha256, "HS384": hashlib.sha384, "HS512": hashlib.sha512}
+if algorithm not in _HMAC_DIGESTS:
+    raise ValueError(f"Unsupported JWT algorithm: {algorithm!r}")
+if not secret_key:
+    raise ValueError("JWT secret_key is not set")
+_jwt_digest = _HMAC_DIGESTS[algorithm]
+
+def _b64url(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+_JWT_HEADER = _b64url(orjson.dumps({"alg": algorithm, "typ": "JWT"}))
+_jwt_key = secret_key.encode()
 
 def create_access_token(user_id: int, expire_time: int = 30) -> str:
-    expire = datetime.utcnow() + timedelta(minutes=expire_time)
     payload = {
         "sub": str(user_id),
-        "exp": expire
+        "exp": int(time.time()) + expire_time * 60
     }
-    token = jwt.encode(payload, secret_key, algorithm=algorithm)
-    return token
+    signing_input = _JWT_HEADER + b"." + _b64url(orjson.dumps(payload))
+    signature = hmac.new(_jwt_key, signing_input, _jwt_digest).digest()
+    return (signing_input + b"." + _b64url(signature)).decode()
 
 # --- REDIS CONNECTION AND OTP LOGIC ---
 redis_url = os.getenv("REDIS_URL")
-# Initialize client variable to None
-r = None 
-
-try:
-    # Assign the connected client to the global variable 'r'
-    r = redis.from_url(redis_url, decode_responses=True)
-    # Ping Redis to verify connection
-    r.ping() 
-    print("Successfully connected to Redis.")
-except Exception as e:
-    # Corrected log message
-    print(f"Could not connect to Redis: {e}")
 
-def generate_otp(email:str,expire_minutes:int=5):
-    # Check if client 'r' is defined and connected
-    if r is None:
-        raise Exception("Redis client is not connected.")
+# Deletes the OTP only when it matches, in a single round trip.
+_VERIFY_OTP_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# One pool per worker; it only opens sockets on first use, so importing stays I/O free.
+# Blocking, so a burst of requests waits for a free connection instead of erroring out.
+_pool = redis.BlockingConnectionPool.from_url(redis_url, max_connections=32, timeout=5, decode_responses=True) if redis_url else None
+_redis_client = None
+_verify_otp_script = None
+_redis_lock = threading.Lock()
 
-    otp = randint(100000, 999999) 
+def _get_redis():
+    global _redis_client, _verify_otp_script
+    if _redis_client is None:
+        with _redis_lock:
+            if _redis_client is None:
+                if _pool is None:
+                    raise redis.ConnectionError("REDIS_URL is not set.")
+                client = redis.Redis(connection_pool=_pool)
+                # A failed ping raises before anything is cached, so the next call retries
+                client.ping()
+                if _verify_otp_script is None:
+                    _verify_otp_script = client.register_script(_VERIFY_OTP_LUA)
+                _redis_client = client
+    return _redis_client
+
+def _reset_redis():
+    # The pool itself discards a failed connection and reconnects on the next checkout,
+    # so only the cached client is dropped; sockets other threads are using stay open.
+    global _redis_client
+    with _redis_lock:
+        _redis_client = None
+
+def _run_redis(operation):
+    try:
+        return operation(_get_redis())
+    except redis.ConnectionError:
+        # Re-ping and retry once
+        _reset_redis()
+        return operation(_get_redis())
+
+def generate_otp(email:str,expire_minutes:int=5):
+    otp = 100000 + randbelow(900000)
     redis_key = f"otp:{email}"
-    # Use the client instance 'r' for setex
-    r.setex(redis_key, timedelta(minutes=expire_minutes), otp)
+    _run_redis(lambda r: r.setex(redis_key, timedelta(minutes=expire_minutes), str(otp)))
     return otp
 
 def verify_otp(email:str,otp_input:int):
-    # If the client is not connected, verification automatically fails
-    if r is None:
-        return False
-        
     redis_key = f"otp:{email}"
-    # Use the client instance 'r' for get
-    stored_otp = r.get(redis_key)
-    
-    if not stored_otp:
-        return False
-        
-    if str(stored_otp) != str(otp_input):
+    try:
+        # Compare and delete atomically, so an OTP can only be redeemed once
+        deleted = _run_redis(lambda r: _verify_otp_script(keys=[redis_key], args=[str(otp_input)], client=r))
+    except redis.ConnectionError:
+        # If Redis is unreachable, verification automatically fails
         return False
-        
-    # Use the client instance 'r' for delete
-    r.delete(redis_key)
-    return True
+    return deleted == 1
 # --- END REDIS LOGIC ---
 
-def otp_email_body(email: str, otp: int, expiry_minutes: int = 5):
-    return f"""
+_OTP_EMAIL_TEMPLATE = Template("""
     <html>
       <body style="font-family: Arial, sans-serif; color: #333;">
         <h2 style="color: #4CAF50;">Expense Tracker - OTP Verification</h2>
         <p>Hello,</p>
-        <p>You requested an OTP for your email <b>{email}</b> in <b>Expense Tracker</b>.</p>
-        <h1 style="color: #FF5722;">{otp}</h1>
-        <p>This OTP will expire in <b>{expiry_minutes} minutes</b>. Please do not share it with anyone.</p>
+        <p>You requested an OTP for your email <b>$email</b> in <b>Expense Tracker</b>.</p>
+        <h1 style="color: #FF5722;">$otp</h1>
+        <p>This OTP will expire in <b>$expiry_minutes minutes</b>. Please do not share it with anyone.</p>
         <hr>
         <p style="font-size: 12px; color: #777;">
           If you didn’t request this OTP or need help, contact us at 
@@ -93,19 +132,63 @@ def otp_email_body(email: str, otp: int, expiry_minutes: int = 5):
         </p>
       </body>
     </html>
-    """
+    """)
+
+def otp_email_body(email: str, otp: int, expiry_minutes: int = 5):
+    return _OTP_EMAIL_TEMPLATE.substitute(email=email, otp=otp, expiry_minutes=expiry_minutes)
+
+# --- SMTP CONNECTION REUSE ---
+# One logged-in SMTP_SSL session per worker process, so each OTP skips the
+# TLS handshake and AUTH round trips. The lock serialises senders on it.
+_smtp = None
+_smtp_lock = threading.Lock()
+# Bounds every socket call, so a half-open session fails instead of hanging the lock
+_SMTP_TIMEOUT = 10
+
+def _get_smtp(send_email: str, send_password: str):
+    global _smtp
+    if _smtp is not None:
+        try:
+            if _smtp.noop()[0] == 250:
+                return _smtp
+        except OSError:
+            pass
+        _close_smtp()
+    server = smtplib.SMTP_SSL('smtp.gmail.com', 465, timeout=_SMTP_TIMEOUT)
+    try:
+        server.login(send_email, send_password)
+    except BaseException:
+        # Never cache a session that did not authenticate
+        server.close()
+        raise
+    _smtp = server
+    return _smtp
+
+def _close_smtp():
+    global _smtp
+    if _smtp is None:
+        return
+    try:
+        _smtp.quit()
+    except OSError:
+        pass
+    _smtp = None
 
 def send_otp_email(to_email:str,otp:int):
       send_email=os.getenv("send_email")
       send_password=os.getenv("send_password")
       body=otp_email_body(to_email,otp)
-      msg=MIMEMultipart()
+      msg=EmailMessage()
       msg['From']=send_email
       msg['To']=to_email
       msg['Subject']="Your OTP Code"
-      msg.attach(MIMEText(body,'html'))
+      msg.set_content(body,subtype='html')
 
-      with smtplib.SMTP_SSL('smtp.gmail.com',465) as server:
-          server.login(send_email,send_password)
-          server.send_message(msg)
+      with _smtp_lock:
+          try:
+              _get_smtp(send_email,send_password).send_message(msg)
+          except (smtplib.SMTPServerDisconnected, ConnectionError):
+              # Gmail drops idle sessions; reconnect once and resend.
+              _close_smtp()
+              _get_smtp(send_email,send_password).send_message(msg)
 
@@ -1,5 +1,6 @@
 from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import and_,or_
 from langchain_core.messages import HumanMessage
@@ -18,7 +19,7 @@ orging = [o.strip() for o in cors_origin_env.split(',')]
 Base.metadata.create_all(bind=engine,checkfirst=True)
 
 oauth_scheme = OAuth2PasswordBearer(tokenUrl="token")
-app = FastAPI(title="Expense Tracker")
+app = FastAPI(title="Expense Tracker", default_response_class=ORJSONResponse)
 
 
 app.add_middleware(